@@ -6,3 +6,19 @@ def multiply_numbers(a, b):
 
 def subtract_numbers(a, b):
     return a - b
+
+
+def add_numbers_batch(a, b, out=None):
+    """Element-wise a + b over arrays or any buffer-protocol sequence."""
+    import numpy as np  # only the batch API needs numpy
+    return np.add(np.asarray(a), np.asarray(b), out=out)
+
+def multiply_numbers_batch(a, b, out=None):
+    """Element-wise a * b over arrays or any buffer-protocol sequence."""
+    import numpy as np
+    return np.multiply(np.asarray(a), np.asarray(b), out=out)
+
+def subtract_numbers_batch(a, b, out=None):
+    """Element-wise a - b over arrays or any buffer-protocol sequence."""
+    import numpy as np
+    return np.subtract(np.asarray(a), np.asarray(b), out=out)
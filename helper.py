@@ -2,3 +2,38 @@ def divide_numbers(a, b):
     if b == 0:
         raise ValueError("Cannot divide by zero!")
     return a / b
+
+
+def divide_numbers_batch(a, b, out=None, on_zero="nan"):
+    """Element-wise a / b in one pass; zero divisors never raise.
+
+    on_zero="nan"   -> zero-divisor slots are set to nan
+    on_zero="mask"  -> returns a masked array with those slots masked
+    on_zero="index" -> returns (result, indices of zero divisors)
+
+    Integer inputs give a float64 result; float32 inputs stay float32. A
+    caller-supplied `out` must be a floating (or complex) array so it can hold nan.
+    """
+    import numpy as np  # only the batch API needs numpy
+
+    if on_zero not in ("nan", "mask", "index"):
+        raise ValueError(f"Unknown on_zero policy: {on_zero}")
+
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if out is None:
+        shape = np.broadcast_shapes(a.shape, b.shape)
+        out = np.empty(shape, dtype=np.result_type(a, b, 1.0))
+    elif not np.issubdtype(out.dtype, np.inexact):
+        raise ValueError(f"out must be a floating array to hold nan, got {out.dtype}")
+
+    nonzero = b != 0
+    np.divide(a, b, out=out, where=nonzero)
+    zero = ~np.broadcast_to(nonzero, out.shape)
+    out[zero] = np.nan
+
+    if on_zero == "mask":
+        return np.ma.masked_array(out, mask=zero)
+    if on_zero == "index":
+        return out, np.flatnonzero(zero)
+    return out
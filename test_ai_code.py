@@ -1,6 +1,15 @@
+import array
+import math
 import unittest
-from ai_code import multiply_numbers, subtract_numbers
-from helper import divide_numbers
+try:
+    import numpy as np
+except ImportError:  # the batch API is optional; the scalar tests still run
+    np = None
+from ai_code import (
+    multiply_numbers, subtract_numbers,
+    add_numbers_batch, multiply_numbers_batch, subtract_numbers_batch,
+)
+from helper import divide_numbers, divide_numbers_batch
 
 class TestMathFunctions(unittest.TestCase):
 
@@ -17,5 +26,47 @@ class TestMathFunctions(unittest.TestCase):
         with self.assertRaises(ValueError):  # Test for zero division
             divide_numbers(10, 0)
 
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestBatchFunctions(unittest.TestCase):
+
+    def test_batch_arithmetic(self):
+        a = np.array([1, 2, 3])
+        b = array.array("l", [4, 5, 6])  # buffer-protocol sequence
+        self.assertEqual(add_numbers_batch(a, b).tolist(), [5, 7, 9])
+        self.assertEqual(multiply_numbers_batch(a, b).tolist(), [4, 10, 18])
+        self.assertEqual(subtract_numbers_batch(a, b).tolist(), [-3, -3, -3])
+
+    def test_batch_out_parameter(self):
+        out = np.empty(3)
+        result = add_numbers_batch([1.0, 2.0, 3.0], [1.0, 1.0, 1.0], out=out)
+        self.assertIs(result, out)
+        self.assertEqual(out.tolist(), [2.0, 3.0, 4.0])
+
+    def test_divide_batch_nan(self):
+        result = divide_numbers_batch([10, 4, 3], [2, 0, 3])
+        self.assertEqual(result[0], 5)
+        self.assertTrue(math.isnan(result[1]))
+        self.assertEqual(result[2], 1)
+
+    def test_divide_batch_mask_and_index(self):
+        masked = divide_numbers_batch([10, 4, 3], [2, 0, 3], on_zero="mask")
+        self.assertEqual(masked.mask.tolist(), [False, True, False])
+        result, zero_idx = divide_numbers_batch([10, 4, 3], [0, 2, 0], on_zero="index")
+        self.assertEqual(zero_idx.tolist(), [0, 2])
+        self.assertEqual(result[1], 2)
+
+    def test_divide_batch_out_and_bad_policy(self):
+        out = np.empty(2)
+        self.assertIs(divide_numbers_batch([1, 2], [1, 0], out=out), out)
+        with self.assertRaises(ValueError):
+            divide_numbers_batch([1], [1], on_zero="skip")
+        with self.assertRaises(ValueError):
+            divide_numbers_batch([1, 2], [1, 0], out=np.empty(2, dtype=np.int64))
+
+    def test_divide_batch_keeps_float32(self):
+        a = np.array([1, 2], dtype=np.float32)
+        self.assertEqual(divide_numbers_batch(a, a).dtype, np.float32)
+        self.assertEqual(divide_numbers_batch([1, 2], [2, 0]).dtype, np.float64)
+
 if __name__ == '__main__':
     unittest.main()
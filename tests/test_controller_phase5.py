@@ -0,0 +1,569 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import controller_phase5 as c  # noqa: E402
+
+BROKEN_CODE = "def add_numbers(a, b):\n    return a + c\n"
+
+
+class ControllerTestCase(unittest.TestCase):
+    """Runs each test inside an empty project directory with slow agents stubbed."""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        c.FIX_HISTORY_DIR.mkdir()
+        Path("ai_code.py").write_text(BROKEN_CODE, encoding="utf-8")
+        c._INDEX_CACHE["files"] = None
+        self.stub("dependency_manager", lambda: None)
+        self.stub("show_metrics_board", lambda: None)
+        patcher = mock.patch.object(c.time, "sleep", lambda seconds: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def stub(self, name, value):
+        patcher = mock.patch.object(c, name, value)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stub_fixer(self, edit=None):
+        """Replace fixer_agent; records calls and optionally rewrites ai_code.py."""
+        calls = []
+
+        def fixer(error_log, lint_log=None, escalate=False, signature=None, tier="fast"):
+            calls.append({"escalate": escalate, "tier": tier, "signature": signature})
+            if edit:
+                Path("ai_code.py").write_text(edit(len(calls)), encoding="utf-8")
+            history_file = c.FIX_HISTORY_DIR / f"fix_{len(calls)}.txt"
+            history_file.write_text("", encoding="utf-8")
+            return history_file, {"prompt": 0}, {"tier": tier, "latency_s": 0.0, "cost_usd": 0.0}
+
+        self.stub("fixer_agent", fixer)
+        return calls
+
+
+class TestProgressTracking(ControllerTestCase):
+
+    def test_normalize_output_keeps_identifiers_and_rating(self):
+        output = (
+            "FAILED test_2s.py::test_a - NameError\n1 failed in 0.06s\n"
+            "Your code has been rated at 3.33/10 (previous run: 3.33/10, +0.00)"
+        )
+        normalized = c.normalize_output(output)
+        self.assertIn("test_2s.py", normalized)
+        self.assertNotIn("0.06s", normalized)
+        self.assertIn("rated at 3.33/10", normalized)
+        self.assertNotIn("previous run", normalized)
+
+    def test_success_needs_no_fixer(self):
+        self.stub("tester_agent", lambda: (0, "1 passed"))
+        self.stub("reviewer_agent", lambda: (9.0, "rated at 9.00/10"))
+        calls = self.stub_fixer()
+        self.assertTrue(c.controller_loop())
+        self.assertEqual(calls, [])
+
+    def test_repeated_state_stops_after_two_fixer_calls(self):
+        self.stub("tester_agent", lambda: (1, "FAILED test_x.py::test_a - NameError"))
+        calls = self.stub_fixer()  # fixer changes nothing -> same state every time
+        self.assertFalse(c.controller_loop(max_attempts=7))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([call["escalate"] for call in calls], [False, True])
+
+    def test_stall_escalates_then_restores_best(self):
+        runs = []
+        self.stub("tester_agent", lambda: (runs.append(1), (1, f"FAILED run {len(runs)}"))[1])
+        calls = self.stub_fixer(edit=lambda n: f"{BROKEN_CODE}# attempt {n}\n")
+        self.assertFalse(c.controller_loop(max_attempts=7, patience=2))
+        self.assertEqual(len(calls), 4)
+        self.assertTrue(calls[2]["escalate"])
+        self.assertEqual(Path("ai_code.py").read_text(encoding="utf-8"), BROKEN_CODE)
+
+
+class TestCheckpoint(ControllerTestCase):
+
+    def count_calls(self, name, result):
+        calls = []
+        self.stub(name, lambda: (calls.append(1), result)[1])
+        return calls
+
+    def interrupt_fixer(self, *args, **kwargs):
+        raise KeyboardInterrupt
+
+    def test_resume_skips_tests_and_lint_with_unchanged_inputs(self):
+        tester_calls = self.count_calls("tester_agent", (0, "1 passed"))
+        reviewer_calls = self.count_calls("reviewer_agent", (5.0, "rated at 5.00/10"))
+        self.stub("fixer_agent", self.interrupt_fixer)
+        with self.assertRaises(KeyboardInterrupt):
+            c.controller_loop()
+        self.assertEqual(c.load_checkpoint()["stage"], "checked")
+
+        fixer_calls = self.stub_fixer(edit=lambda n: "def add_numbers(a, b):\n    return a + b\n")
+        self.stub("reviewer_agent", lambda: (reviewer_calls.append(1), (9.0, "rated at 9.00/10"))[1])
+        self.assertTrue(c.controller_loop(resume=True))
+        self.assertEqual(len(fixer_calls), 1)
+        self.assertEqual(len(tester_calls), 2)    # initial run + after the fix
+        self.assertEqual(len(reviewer_calls), 2)
+        self.assertEqual(c.load_checkpoint()["stage"], "done")
+
+    def test_checkpoint_holds_hashes_not_sources_or_logs(self):
+        long_log = "FAILED test_x.py::test_a - NameError " + "x" * 5000
+        self.count_calls("tester_agent", (1, long_log))
+        self.stub_fixer()
+        c.controller_loop(max_attempts=1)
+        checkpoint = c.CHECKPOINT_FILE.read_text(encoding="utf-8")
+        self.assertNotIn("return a + c", checkpoint)
+        self.assertNotIn("x" * 100, checkpoint)
+        self.assertLess(len(checkpoint), 3000)
+        best_tree = c.load_checkpoint()["best_tree"]
+        self.assertEqual(c.load_blob(best_tree["ai_code.py"]), BROKEN_CODE)
+
+    def test_environment_change_invalidates_cached_results(self):
+        tester_calls = self.count_calls("tester_agent", (1, "FAILED test_x.py::test_a"))
+        self.stub("fixer_agent", self.interrupt_fixer)
+        with self.assertRaises(KeyboardInterrupt):
+            c.controller_loop()
+        self.stub("environment_fingerprint", lambda: "numpy installed")
+        with self.assertRaises(KeyboardInterrupt):
+            c.controller_loop(resume=True)
+        self.assertEqual(len(tester_calls), 2)
+
+    def test_data_files_are_part_of_the_key(self):
+        Path("data.csv").write_text("a,b\n", encoding="utf-8")
+        key = c.results_key(c.scan_project_files())
+        Path("data.csv").write_text("a,b\n1,2\n", encoding="utf-8")
+        self.assertNotEqual(c.results_key(c.scan_project_files()), key)
+
+    def test_key_survives_a_real_pytest_run(self):
+        Path("test_ok.py").write_text("def test_ok():\n    assert True\n", encoding="utf-8")
+        key = c.results_key(c.scan_project_files())
+        self.assertEqual(c.tester_agent()[0], 0)
+        self.assertTrue(Path(".pytest_cache").is_dir())
+        self.assertEqual(c.results_key(c.scan_project_files()), key)
+
+
+class TestFixIndex(ControllerTestCase):
+
+    TEST_OUTPUT = (
+        "ai_code.py:2: NameError\n"
+        "FAILED test_ai_code.py::test_add - NameError: name 'c' is not defined"
+    )
+
+    def setUp(self):
+        super().setUp()
+        Path("helper.py").write_text("def divide_numbers(a, b):\n    return a / b\n", encoding="utf-8")
+
+    def test_signature_ignores_unrelated_files(self):
+        key, parts = c.error_signature(self.TEST_OUTPUT, "", c.snapshot_project())
+        self.assertEqual(parts["files"], ["ai_code.py"])
+        self.assertEqual(parts["exceptions"], ["NameError"])
+
+        Path("helper.py").write_text("# unrelated edit\n", encoding="utf-8")
+        self.assertEqual(c.error_signature(self.TEST_OUTPUT, "", c.snapshot_project())[0], key)
+
+        Path("ai_code.py").write_text(BROKEN_CODE + "# changed\n", encoding="utf-8")
+        self.assertNotEqual(c.error_signature(self.TEST_OUTPUT, "", c.snapshot_project())[0], key)
+
+    def test_known_fix_is_reused_for_attributed_files_only(self):
+        signature = c.error_signature(self.TEST_OUTPUT, "", c.snapshot_project())
+        fix_file = c.FIX_HISTORY_DIR / "ai_fix_known.txt"
+        fix_file.write_text(
+            "### ai_code.py\ndef add_numbers(a, b):\n    return a + b\n"
+            "### helper.py\nBROKEN = True\n",
+            encoding="utf-8"
+        )
+        c.record_fix(signature, fix_file)
+
+        self.stub("client", None)  # any model call would fail
+        applied, _, route = c.fixer_agent(self.TEST_OUTPUT, None, signature=signature)
+        self.assertEqual(applied, fix_file)
+        self.assertEqual(route["tier"], "local")
+        self.assertIn("return a + b", Path("ai_code.py").read_text(encoding="utf-8"))
+        self.assertNotIn("BROKEN", Path("helper.py").read_text(encoding="utf-8"))
+
+    def test_failed_reuse_is_forgotten(self):
+        self.stub("tester_agent", lambda: (1, self.TEST_OUTPUT))
+        fix_file = c.FIX_HISTORY_DIR / "ai_fix_known.txt"
+        fix_file.write_text("### ai_code.py\n" + BROKEN_CODE, encoding="utf-8")
+        calls = []
+
+        def fixer(error_log, lint_log=None, escalate=False, signature=None, tier="fast"):
+            calls.append(signature)
+            if len(calls) == 1:  # replay a recorded fix that does not help
+                c.record_fix(signature, fix_file)
+                return fix_file, {"cached": True}, {"tier": "local", "latency_s": 0.0, "cost_usd": 0.0}
+            self.assertIsNone(c.lookup_fix(signature))
+            return None, {"prompt": 0}, {"tier": tier, "latency_s": 0.0, "cost_usd": 0.0}
+
+        self.stub("fixer_agent", fixer)
+        c.controller_loop(max_attempts=2, patience=5)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(c.load_fix_index(), {})
+
+
+class TestLogCompression(ControllerTestCase):
+
+    def run_pytest(self):
+        Path("mod.py").write_text(
+            "def rec(n):\n    if n == 0:\n        return 1 / 0\n    return rec(n - 1)\n",
+            encoding="utf-8"
+        )
+        Path("test_mod.py").write_text(
+            "from mod import rec\n\ndef test_a():\n    assert rec(5)\n\n"
+            "def test_ok():\n    assert True\n",
+            encoding="utf-8"
+        )
+        result = subprocess.run(
+            [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", "test_mod.py"],
+            text=True, capture_output=True, timeout=60
+        )
+        return result.stdout + result.stderr
+
+    def test_real_pytest_output_is_compressed(self):
+        output = self.run_pytest()
+        self.assertEqual(output.count("mod.py:4: in rec"), 5)
+
+        compressed = c.compress_test_log(output)
+        self.assertEqual(compressed.count("mod.py:4: in rec"), 1)
+        self.assertIn("[4 repeated frames]", compressed)
+        self.assertNotIn("[100%]", compressed)
+        self.assertIn("ZeroDivisionError", compressed)
+        self.assertIn("FAILED test_mod.py::test_a", compressed)
+        self.assertLess(c.count_tokens(compressed), c.count_tokens(output))
+
+    def test_lint_messages_grouped_by_code(self):
+        lint = "\n".join(
+            f"ai_code.py:{i}:0: C0116: Missing function or method docstring" for i in range(1, 6)
+        ) + "\nai_code.py:1:0: W0611: Unused import os\n" \
+            "Your code has been rated at 3.33/10"
+        compressed = c.compress_lint_log(lint, top_n=1)
+        self.assertIn("C0116 x5", compressed)
+        self.assertNotIn("W0611", compressed)
+        self.assertIn("1 more message code(s) omitted", compressed)
+        self.assertIn("rated at 3.33/10", compressed)
+
+
+class TestPromptBudget(ControllerTestCase):
+
+    ERROR_LOG = "ai_code.py:2: NameError\n" + "E   NameError: name 'c' is not defined\n" * 200
+
+    def setUp(self):
+        super().setUp()
+        Path("big.py").write_text("VALUE = 1  # padding\n" * 400, encoding="utf-8")
+
+    def test_prompt_within_budget_drops_unrelated_files(self):
+        self.stub("PROMPT_TOKEN_BUDGET", 1500)
+        prompt, stats = c.build_prompt(c.collect_project_code(), self.ERROR_LOG, None)
+        self.assertEqual(stats["files_dropped"], ["big.py"])
+        self.assertNotIn("### big.py", prompt)
+        self.assertIn("### ai_code.py", prompt)
+        self.assertLessEqual(stats["prompt"], 1500)
+        self.assertFalse(stats["over_budget"])
+        self.assertEqual(stats["overhead"], c.count_tokens(c.FIXER_PROMPT.format(
+            file_contents="", error_part="", lint_part="", escalate_part="", focus_part=""
+        )))
+
+    def test_over_budget_is_recorded(self):
+        self.stub("PROMPT_TOKEN_BUDGET", 1500)
+        prompt, stats = c.build_prompt([Path("big.py")], "big.py:1: error", None)
+        self.assertIn("### big.py", prompt)
+        self.assertTrue(stats["over_budget"])
+
+
+class TestProjectTests(ControllerTestCase):
+    """The project's own tests/ directory is run and indexed; only the controller suite is hidden."""
+
+    def setUp(self):
+        super().setUp()
+        Path("tests").mkdir()
+        Path("conftest.py").write_text("", encoding="utf-8")  # puts the project root on sys.path
+        Path("tests/test_mod.py").write_text(
+            "from ai_code import add_numbers\n\ndef test_add():\n    assert add_numbers(1, 1) == 3\n",
+            encoding="utf-8",
+        )
+        Path(c.CONTROLLER_TESTS).write_text("def test_controller():\n    pass\n", encoding="utf-8")
+        Path("ai_code.py").write_text("def add_numbers(a, b):\n    return a + b\n", encoding="utf-8")
+
+    def test_tester_runs_project_tests_dir(self):
+        code, output = c.tester_agent()
+        self.assertEqual(code, 1)
+        self.assertIn("tests/test_mod.py::test_add", output)
+        self.assertNotIn("test_controller", output)
+
+    def test_benchmarks_follow_imports_from_tests_dir(self):
+        self.assertEqual(c.benchmark_modules(), ["ai_code"])
+
+
+class TestFileIndex(ControllerTestCase):
+
+    def test_gitignore_matcher(self):
+        patterns = ["build/", "/local.py", "docs/*.md", "*.log"]
+        self.assertTrue(c.is_ignored("build", True, patterns))
+        self.assertFalse(c.is_ignored("build", False, patterns))
+        self.assertTrue(c.is_ignored("local.py", False, patterns))
+        self.assertFalse(c.is_ignored("pkg/local.py", False, patterns))
+        self.assertTrue(c.is_ignored("docs/guide.md", False, patterns))
+        self.assertTrue(c.is_ignored("pkg/run.log", False, patterns))
+        self.assertFalse(c.is_ignored("pkg/run.py", False, patterns))
+
+    def test_path_wildcards_stop_at_slash(self):
+        self.assertTrue(c.is_ignored("docs/a.md", False, ["docs/*.md"]))
+        self.assertFalse(c.is_ignored("docs/a/b.md", False, ["docs/*.md"]))
+        self.assertTrue(c.is_ignored("docs/a/b.md", False, ["docs/**/*.md"]))
+        self.assertTrue(c.is_ignored("docs/b.md", False, ["docs/**/*.md"]))
+        self.assertTrue(c.is_ignored("a/b/gen", True, ["**/gen/"]))
+        self.assertTrue(c.is_ignored("out/x1.py", False, ["/out/x[0-9].py"]))
+        self.assertFalse(c.is_ignored("out/xa.py", False, ["/out/x[!a].py"]))
+
+    def test_nested_gitignore_applies_to_its_subtree(self):
+        for rel_path in ["pkg/mod.py", "pkg/cache.tmp", "pkg/sub/local.py", "pkg/local.py", "top.tmp"]:
+            Path(rel_path).parent.mkdir(parents=True, exist_ok=True)
+            Path(rel_path).write_text("x = 1\n", encoding="utf-8")
+        Path("pkg/.gitignore").write_text("*.tmp\n/local.py\n", encoding="utf-8")
+        self.assertEqual(
+            sorted(c.scan_project_files()),
+            ["ai_code.py", "pkg/.gitignore", "pkg/mod.py", "pkg/sub/local.py", "top.tmp"],
+        )
+
+    def test_scan_honours_gitignore_and_defaults(self):
+        Path(".gitignore").write_text("# comment\nbuild/\n*.log\n", encoding="utf-8")
+        for rel_path in ["pkg/util.py", "build/out.py", "tests/test_x.py", "run.log", c.CONTROLLER_TESTS]:
+            Path(rel_path).parent.mkdir(parents=True, exist_ok=True)
+            Path(rel_path).write_text("x = 1\n", encoding="utf-8")
+        index = c.scan_project_files()
+        self.assertEqual(sorted(index), [".gitignore", "ai_code.py", "pkg/util.py", "tests/test_x.py"])
+        self.assertTrue(c.FILE_INDEX_FILE.exists())
+
+    def test_symlinks_are_skipped(self):
+        Path("pkg").mkdir()
+        Path("pkg/util.py").write_text("x = 1\n", encoding="utf-8")
+        try:
+            os.symlink("pkg", "pkg_link", target_is_directory=True)
+            os.symlink("missing.py", "dangling.py")
+            os.symlink("ai_code.py", "alias.py")
+        except (OSError, NotImplementedError):
+            self.skipTest("symlinks are not supported here")
+        self.assertEqual(sorted(c.scan_project_files()), ["ai_code.py", "pkg/util.py"])
+
+    def test_extra_excludes_add_to_defaults_without_touching_cache(self):
+        Path("pkg").mkdir()
+        Path("pkg/util.py").write_text("x = 1\n", encoding="utf-8")
+        Path("fix_history/note.txt").write_text("", encoding="utf-8")
+        full = c.scan_project_files()
+        saved = c.FILE_INDEX_FILE.read_text(encoding="utf-8")
+
+        narrowed = c.scan_project_files(excludes=["pkg/"])
+        self.assertEqual(sorted(narrowed), ["ai_code.py"])
+        self.assertEqual(c._INDEX_CACHE["files"], full)
+        self.assertEqual(c.FILE_INDEX_FILE.read_text(encoding="utf-8"), saved)
+
+    def test_unchanged_files_are_not_rehashed(self):
+        c.scan_project_files()
+        with mock.patch.object(c.hashlib, "sha256", side_effect=AssertionError("rehashed")):
+            c.scan_project_files()
+
+
+class LoopBoundAsyncClient:
+    """Stub AsyncOpenAI whose connections, like httpx's, only work on one event loop."""
+
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.loop, self.closed = None, False
+        self.chat = self.completions = self
+        LoopBoundAsyncClient.instances.append(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.closed = True
+
+    async def create(self, model, messages, temperature):
+        loop = asyncio.get_running_loop()
+        if self.loop not in (None, loop):
+            raise RuntimeError("Event loop is closed")
+        self.loop = loop
+        name = "ai_code.py" if "Only fix ai_code.py" in messages[0]["content"] else "helper.py"
+        content = f"### {name}\nFIXED = True\n"
+        message = mock.Mock(content=content)
+        return mock.Mock(choices=[mock.Mock(message=message)], usage=None)
+
+
+class TestFanOut(ControllerTestCase):
+
+    def test_fan_out_twice_in_one_process(self):
+        Path("helper.py").write_text("def divide_numbers(a, b):\n    return a / b\n", encoding="utf-8")
+        LoopBoundAsyncClient.instances = []
+        self.stub("AsyncOpenAI", LoopBoundAsyncClient)
+        targets = [Path("ai_code.py"), Path("helper.py")]
+        for _ in range(2):
+            merged, stats, usage = asyncio.run(c.fan_out_fix(targets, "ai_code.py:2: x", None))
+            self.assertIn("### ai_code.py\nFIXED = True", merged)
+            self.assertIn("### helper.py\nFIXED = True", merged)
+            self.assertEqual(set(stats["fanout"]), {"ai_code.py", "helper.py"})
+        self.assertEqual(len(LoopBoundAsyncClient.instances), 2)
+        self.assertTrue(all(client.closed for client in LoopBoundAsyncClient.instances))
+
+
+class TestModelRouting(ControllerTestCase):
+
+    def write_fast_history(self, outcomes):
+        """One fast-tier fix per outcome, followed by "success" or another failure."""
+        route = {"tier": "fast", "latency_s": 1.0, "cost_usd": 0.001}
+        entries = []
+        for ok in outcomes:
+            entries.append({"status": "fix attempted", "route": route})
+            entries.append({"status": "success" if ok else "tests failed"})
+        c.METRICS_FILE.write_text(json.dumps(entries), encoding="utf-8")
+
+    def test_route_tier(self):
+        self.assertEqual(c.route_tier(False, 0, False, 0, 2), "fast")
+        self.assertEqual(c.route_tier(False, 2, False, 0, 2), "strong")
+        self.assertEqual(c.route_tier(True, 2, False, 0, 2), "fast")  # lint-only gets one more try
+        self.assertEqual(c.route_tier(True, 3, False, 0, 2), "strong")
+        self.assertEqual(c.route_tier(False, 0, True, 0, 2), "strong")
+        self.assertEqual(c.route_tier(False, 0, False, c.LARGE_DIFF_LINES + 1, 2), "strong")
+
+    def test_tier_stats_credit_the_fix_before_a_success(self):
+        self.write_fast_history([True, False, False, True])
+        fast = c.tier_stats()["fast"]
+        self.assertEqual(fast["calls"], 4)
+        self.assertEqual(fast["success_rate"], 0.5)
+        self.assertEqual(fast["cost_usd"], 0.004)
+
+    def test_escalate_after_needs_enough_samples(self):
+        self.write_fast_history([False] * (c.TIER_MIN_SAMPLES - 1))
+        self.assertEqual(c.tuned_escalate_after(), c.ESCALATE_AFTER)
+
+    def test_escalate_after_follows_fast_tier_success(self):
+        self.write_fast_history([False] * c.TIER_MIN_SAMPLES)
+        self.assertEqual(c.tuned_escalate_after(), max(1, c.ESCALATE_AFTER - 1))
+        self.write_fast_history([True] * c.TIER_MIN_SAMPLES)
+        self.assertEqual(c.tuned_escalate_after(), c.ESCALATE_AFTER + 1)
+
+    def test_loop_escalates_after_failed_fast_attempts(self):
+        runs = []
+        self.stub("tester_agent", lambda: (runs.append(1), (1, f"FAILED run {len(runs)}"))[1])
+        self.stub("reviewer_agent", lambda: (9.0, "rated at 9.00/10"))
+        calls = self.stub_fixer(edit=lambda n: f"{BROKEN_CODE}# attempt {n}\n")
+        c.controller_loop(max_attempts=3, patience=5)
+        self.assertEqual([call["tier"] for call in calls][:3], ["fast", "fast", "strong"])
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestBenchmarks(ControllerTestCase):
+
+    def test_vectorized_functions_get_array_inputs(self):
+        Path("vecmod.py").write_text(
+            "import numpy as np\n\n"
+            "def scale(a, b):\n    return a * b\n\n"
+            "def scale_batch(a, b):\n    return np.multiply(a, b)\n",
+            encoding="utf-8",
+        )
+        Path("test_vecmod.py").write_text("import vecmod\n", encoding="utf-8")
+        self.stub("BENCH_ARRAY_SIZE", 1000)
+        report = c.benchmark_agent()
+        self.assertEqual(sorted(report["benchmarks"]), ["vecmod.scale", "vecmod.scale_batch[n=1000]"])
+        self.assertGreater(report["benchmarks"]["vecmod.scale_batch[n=1000]"]["peak_bytes"], 8000)
+
+
+class TestOptimizer(ControllerTestCase):
+
+    def stub_model(self, reply):
+        """Stub the sync client; returns the mock so prompts can be inspected."""
+        message = mock.Mock(content=reply)
+        fake_client = mock.Mock()
+        fake_client.chat.completions.create.return_value = mock.Mock(choices=[mock.Mock(message=message)])
+        self.stub("client", fake_client)
+        return fake_client
+
+    def test_optimizer_cannot_rewrite_tests(self):
+        Path("test_ai_code.py").write_text("from ai_code import add_numbers\n", encoding="utf-8")
+        self.stub_model(
+            "### ai_code.py\ndef add_numbers(a, b):\n    return a + b\n"
+            "### test_ai_code.py\ndef test_nothing():\n    pass\n"
+        )
+
+        report = {"benchmarks": {}, "profile": ""}
+        c.optimizer_agent(report)
+        self.assertIn("return a + b", Path("ai_code.py").read_text(encoding="utf-8"))
+        self.assertEqual(
+            Path("test_ai_code.py").read_text(encoding="utf-8"), "from ai_code import add_numbers\n"
+        )
+
+    def test_bench_files_select_the_modules_they_import(self):
+        Path("fastmod.py").write_text("def square(x):\n    return x * x\n", encoding="utf-8")
+        Path("bench_fast.py").write_text(
+            "from fastmod import square\n\ndef bench_square():\n    square(3)\n", encoding="utf-8"
+        )
+        fake_client = self.stub_model(
+            "### fastmod.py\ndef square(x):\n    return x ** 2\n"
+            "### bench_fast.py\ndef bench_square():\n    pass\n"
+        )
+
+        c.optimizer_agent({"benchmarks": {}, "profile": ""})
+        prompt = fake_client.chat.completions.create.call_args.kwargs["messages"][0]["content"]
+        self.assertIn("### fastmod.py", prompt)
+        self.assertNotIn("### ai_code.py", prompt)
+        self.assertIn("x ** 2", Path("fastmod.py").read_text(encoding="utf-8"))
+        self.assertIn("square(3)", Path("bench_fast.py").read_text(encoding="utf-8"))
+
+
+def bench(**cases):
+    return {"benchmarks": {
+        name: {"median": median, "min": median, "cv": 0.01, "peak_bytes": peak}
+        for name, (median, peak) in cases.items()
+    }}
+
+
+class TestPerfComparison(unittest.TestCase):
+
+    def test_uniform_speedup_is_accepted(self):
+        base = bench(add=(1e-6, 0), batch=(1e-3, 80000))
+        new = bench(add=(0.8e-6, 0), batch=(0.8e-3, 80000))
+        accepted, time_gain, _ = c.perf_improved(base, new)
+        self.assertTrue(accepted)
+        self.assertAlmostEqual(time_gain, 0.2, places=3)
+
+    def test_regression_hidden_by_big_case_is_rejected(self):
+        base = bench(add=(1e-6, 0), batch=(1e-3, 80000))
+        new = bench(add=(2e-6, 0), batch=(0.5e-3, 80000))
+        accepted, _, _ = c.perf_improved(base, new)
+        self.assertFalse(accepted)
+
+    def test_memory_regression_is_rejected(self):
+        base = bench(add=(1e-6, 0), batch=(1e-3, 80000))
+        new = bench(add=(0.5e-6, 0), batch=(0.5e-3, 160000))
+        accepted, _, mem_gain = c.perf_improved(base, new)
+        self.assertFalse(accepted)
+        self.assertLess(mem_gain, 0)
+
+    def test_small_allocation_jitter_is_ignored(self):
+        base = bench(add=(1e-6, 100), batch=(1e-3, 80000))
+        new = bench(add=(0.8e-6, 300), batch=(0.8e-3, 80000))
+        accepted, _, _ = c.perf_improved(base, new)
+        self.assertTrue(accepted)
+
+
+if __name__ == '__main__':
+    unittest.main()